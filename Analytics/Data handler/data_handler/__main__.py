@@ -1,17 +1,75 @@
 __author__ = 'Erik Aumayr'
 
 from os import environ
+from threading import Lock
 from datetime import datetime
-from flask import Flask, request
-import json
+from flask import Flask, Response, request
+from flask.json import JSONEncoder
+from flask_compress import Compress
+import orjson
 import yaml
 import pandas as pd
+from cachetools import TTLCache
 from data_handler.collect_data import DataCollector
 from data_handler.time_series_matching import synchronize
 from data_handler.outlier_detection import remove
 
 
+# Accepted values of boolean request parameters and outlier_detection modes by name
+TRUE_VALUES = frozenset({'true', '1', 'yes', 'on'})
+OUTLIER_MODES = {'zscore': 0, 'mad': 1}
+
+
+class OrjsonEncoder(JSONEncoder):
+    """
+    Flask JSON encoder backed by orjson. Types orjson cannot handle are passed to Flask's default().
+    """
+    def encode(self, o):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(o, default=self.default, option=option).decode()
+
+
 app = Flask(__name__)
+app.json_encoder = OrjsonEncoder
+# gzip JSON responses; level 1 gets most of the size reduction at little CPU cost
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 1
+Compress(app)
+
+
+def to_json(data):
+    """
+    Serialise a data frame or a dictionary of data frames to JSON bytes.
+    The per-frame JSON produced by pandas is embedded as is (as orjson fragments), avoiding a json.loads round-trip and a second encoding pass in Flask.
+    """
+    if isinstance(data, pd.DataFrame):
+        return unique_columns(data).to_json().encode()
+    return orjson.dumps({str(name): orjson.Fragment(unique_columns(df).to_json()) for name, df in data.items()})
+
+
+def unique_columns(df):
+    """
+    Keep only the last of any duplicate columns (e.g. tag columns repeated per measurement), which pandas cannot serialise.
+    """
+    if df.columns.is_unique:
+        return df
+    return df.loc[:, ~df.columns.duplicated(keep='last')]
+
+
+def to_relative_time(df):
+    """
+    Shift the (sorted) time index of a data frame so that it starts at zero.
+    The index is sorted, so its first value is used instead of scanning for the minimum. Works on a shallow copy so that cached data frames are not modified.
+    """
+    df = df.copy(deep=False)
+    if not df.empty:
+        df.index = df.index - df.index[0]
+    return df
 
 
 @app.route('/', methods=['GET'])
@@ -49,8 +107,10 @@ def get_help():
 
 @app.route("/purge_cache", methods=["GET"])
 def purge_cache():
-    global data_cache
-    data_cache = {}
+    with cache_lock:
+        data_cache.clear()
+    for source in sources.values():
+        source.clear_cache()
     return {"message": "Cache purged"}, 200
 
 
@@ -61,51 +121,60 @@ def get_datasources():
 
 @app.route("/get_all_experimentIds/<string:datasource>", methods=["GET"])
 def get_all_executionIds(datasource):
-    if datasource not in sources or not sources[datasource].client:
+    source = sources.get(datasource)
+    if source is None or not source.client:
         return {"error": f"Data source {datasource} is not available."}, 404
-    experimentIds = getattr(sources[datasource], "get_all_experimentIds")()
+    experimentIds = source.get_all_experimentIds()
     return {f"ExperimentIds on {datasource}": experimentIds}, 200
 
 
 @app.route('/get_experimentIds_for_measurement/<string:datasource>/<string:measurement>', methods=['GET'])
 def get_excutionIds(datasource, measurement):
-    if datasource not in sources or not sources[datasource].client:
+    source = sources.get(datasource)
+    if source is None or not source.client:
         return {"error": f"Data source {datasource} is not available."}, 404
-    experimentIds = getattr(sources[datasource], "get_experimentIds_for_measurement")(measurement)
+    experimentIds = source.get_experimentIds_for_measurement(measurement)
     return {f"ExperimentIds for measurement {measurement} on {datasource}": experimentIds}, 200
 
 
 @app.route('/get_measurements_for_experimentId/<string:datasource>/<string:experimentId>', methods=['GET'])
 def get_measurements(datasource, experimentId):
-    if datasource not in sources or not sources[datasource].client:
+    source = sources.get(datasource)
+    if source is None or not source.client:
         return {"error": f"Data source {datasource} is not available."}, 404
-    measurements = getattr(sources[datasource], "get_measurements_for_experimentId")(experimentId)
+    measurements = source.get_measurements_for_experimentId(experimentId)
     return {f"Measurements for experimentId {experimentId} on {datasource}": measurements}, 200
 
 
-def retrieve_data(datasource, experimentId, measurements=[], fields=[], match_series=False, remove_outliers=None, additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag='1s'):
+def retrieve_data(datasource, experimentId, measurements=[], fields=[], match_series=False, remove_outliers=None, additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag='1s', serialize=False):
+    """
+    Retrieve and post-process data. With serialize=True the JSON response body is returned (and cached) as bytes instead of the data frames, empty bytes meaning no data.
+    """
     start = datetime.now()
-    if datasource not in sources or not sources[datasource].client:
+    source = sources.get(datasource)
+    if source is None or not source.client:
         return None
-    dataid = str(datasource) + str(experimentId) + ''.join(sorted(measurements)) + str(fields) + str(remove_outliers) + str(match_series) + str(additional_clause) + str(max_lag) + str(limit)
+    dataid = (serialize, datasource, experimentId, tuple(sorted(measurements)), tuple(sorted(fields)), remove_outliers, match_series, additional_clause, max_lag, limit, offset)
+    data = None
     if enable_cache:
-        global data_cache
-        if dataid not in data_cache:
-            print('-- Retrieving uncached data', flush=True)
-            data = getattr(sources[datasource], "get_data")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag)
-            data_cache[dataid] = data
-        else:
-            print('-- Using cached data', flush=True)
-            data = data_cache[dataid]
+        with cache_lock:
+            data = data_cache.get(dataid)
+    if data is not None:
+        print('-- Using cached data', flush=True)
     else:
-        data = getattr(sources[datasource], "get_data")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag)
-    if match_series:
-        data = synchronize(dataframes=data, max_lag=max_lag, merge=True)
-    if remove_outliers:
-        if remove_outliers.lower() == 'zscore':
-            data = remove(data, 0)
-        if remove_outliers.lower() == 'mad':
-            data = remove(data, 1)
+        if enable_cache:
+            print('-- Retrieving uncached data', flush=True)
+        data = source.get_data(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag)
+        if match_series:
+            data = synchronize(dataframes=data, max_lag=max_lag, merge=True)
+        outlier_mode = OUTLIER_MODES.get((remove_outliers or '').lower())
+        if outlier_mode is not None:
+            data = remove(data, outlier_mode)
+        if serialize:
+            data = b'' if type(data) == pd.DataFrame and data.empty or type(data) == dict and data == {} else to_json(data)
+        if enable_cache:
+            with cache_lock:
+                data_cache[dataid] = data
     print(datetime.now() - start, flush=True)
     return data
 
@@ -117,11 +186,11 @@ def get_data(datasource, experimentId1, experimentId2):
     fields = request.args.getlist('field')
     additional_clause = request.args.get('additional_clause')
     chunked = request.args.get('chunked')
-    chunked = chunked.lower() == 'true' if chunked else False
+    chunked = chunked.lower() in TRUE_VALUES if chunked else False
     chunk_size = request.args.get('chunk_size')
     chunk_size = int(chunk_size) if chunk_size else 10000
     match_series = request.args.get('match_series')
-    match_series = match_series.lower() == 'true' if match_series else False
+    match_series = match_series.lower() in TRUE_VALUES if match_series else False
     remove_outliers = request.args.get('remove_outliers')  # zscore, mad or None
     limit = request.args.get('limit')
     if limit:
@@ -131,22 +200,19 @@ def get_data(datasource, experimentId1, experimentId2):
         offset = int(offset)
     max_lag = request.args.get('max_lag', '1s')
     if not experimentId2:
-        data = retrieve_data(datasource, experimentId1, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
-        if type(data) == pd.DataFrame and data.empty or type(data) == dict and data == {}:
+        data = retrieve_data(datasource, experimentId1, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag, serialize=True)
+        if not data:
             return {"error": f"Data source {datasource} is currently not available."}, 404
-        jsonobjects = {name: json.loads(df.to_json()) for name, df in data.items()}
-        return jsonobjects, 200
+        return Response(data, status=200, mimetype='application/json')
     else:
         series1 = retrieve_data(datasource, experimentId1, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
         if series1 is None:
             return {"error": f"Data source {datasource} is currently not available."}, 404
-        series1.index = series1.index - series1.index.min()
+        series1 = to_relative_time(series1)
         series2 = retrieve_data(datasource, experimentId2, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
-        series2.index = series2.index - series2.index.min()
+        series2 = to_relative_time(series2)
         series_dict = synchronize(dataframes={'series1': series1, 'series2': series2}, max_lag=max_lag, merge=False)
-        for series_name, series in series_dict.items():
-            series_dict[series_name] = json.loads(series.to_json())
-        return series_dict, 200
+        return Response(to_json(series_dict), status=200, mimetype='application/json')
 
 
 def get_secrets():
@@ -161,6 +227,9 @@ if __name__ == '__main__':
     # Get login details from secret
     secrets = get_secrets()
     sources = {}
+    enable_cache = environ.get("ENABLE_CACHE", "False").lower() == "true"
+    # experiment ID and measurement lookups are only cached (for 5 minutes) together with the data
+    lookup_cache_ttl = 300 if enable_cache else 0
 
     if secrets:
         connections = yaml.safe_load(secrets)
@@ -183,6 +252,7 @@ if __name__ == '__main__':
                     org=con_details["org"],
                     bucket=con_details["bucket"],
                     token=con_details["token"],
+                    cache_ttl=lookup_cache_ttl,
                 )
                 continue
 
@@ -197,6 +267,7 @@ if __name__ == '__main__':
                             org=con_details["org"],
                             bucket=bucket,
                             token=con_details["token"],
+                            cache_ttl=lookup_cache_ttl,
                         )
                 else:
                     print(f"[WARN] Skipping legacy v1 source '{con_name}': need url/org/token to work with InfluxDB v2.")
@@ -204,9 +275,9 @@ if __name__ == '__main__':
 
             print(f"[WARN] Unrecognized config for '{con_name}': {list(con_details.keys())}")
 
-    # Data cache
-    data_cache = {}
-    enable_cache = environ.get("ENABLE_CACHE", "False").lower() == "true"
+    # Data cache (least recently used entries are evicted beyond CACHE_MAX, all entries expire after CACHE_TTL_SEC)
+    data_cache = TTLCache(maxsize=int(environ.get("CACHE_MAX", 256)), ttl=int(environ.get("CACHE_TTL_SEC", 600)))
+    cache_lock = Lock()
 
     # Start app
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -1,7 +1,7 @@
 """
 InfluxDB v2 / Flux collector (drop-in replacement for the old v1 version).
 - Uses the v2 Python client (influxdb_client).
-- Computes experiment IDs live from Flux (no stale startup cache).
+- Computes experiment IDs live from Flux (no stale startup cache; lookups can be kept for cache_ttl seconds).
 - Reads Swarm secret at /run/secrets/analytics_connections by default.
 
 Expected secret YAML (example):
@@ -14,11 +14,16 @@ Expected secret YAML (example):
 
 from __future__ import annotations
 
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
+from threading import Lock
 from typing import Iterable, Optional, Dict, Any
 
 import yaml
 import pandas as pd
+from cachetools import TTLCache
+from cachetools.keys import hashkey
 from influxdb_client import InfluxDBClient  # v2 client
 
 
@@ -36,6 +41,44 @@ def _load_secret(path: Optional[str] = None) -> Dict[str, Any]:
     return data.get("uma", data)
 
 
+# ---------------------------- flux ----------------------------
+
+def _flux_string(value: Any) -> str:
+    """
+    Quote a value as a Flux string literal, escaping backslashes, double quotes
+    and string interpolation so that user input cannot alter the query.
+    """
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${")
+    return f'"{escaped}"'
+
+
+# ---------------------------- caching ----------------------------
+
+def _cached_lookup(cache_attr: str):
+    """
+    Cache the non-empty results of a lookup method in the collector's TTLCache
+    named cache_attr. Empty results are not stored, so data that starts arriving
+    shows up immediately; without a cache (caching disabled) the method always runs.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, cache_attr)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            key = hashkey(*args, **kwargs)
+            with self._cache_lock:
+                result = cache.get(key)
+            if result is None:
+                result = method(self, *args, **kwargs)
+                if result:
+                    with self._cache_lock:
+                        cache[key] = result
+            return result
+        return wrapper
+    return decorator
+
+
 # ---------------------------- collector ----------------------------
 
 class DataCollector:
@@ -54,9 +97,9 @@ class DataCollector:
     # ---- preferred constructor
 
     @classmethod
-    def from_secret(cls, secret_path: Optional[str] = None) -> "DataCollector":
+    def from_secret(cls, secret_path: Optional[str] = None, cache_ttl: int = 0) -> "DataCollector":
         cfg = _load_secret(secret_path)
-        return cls(url=cfg["url"], org=cfg["org"], bucket=cfg["bucket"], token=cfg["token"])
+        return cls(url=cfg["url"], org=cfg["org"], bucket=cfg["bucket"], token=cfg["token"], cache_ttl=cache_ttl)
 
     # ---- init
 
@@ -74,6 +117,7 @@ class DataCollector:
         token: Optional[str] = None,
         secret_path: Optional[str] = None,
         timeout_ms: int = 30000,
+        cache_ttl: int = 0,               # seconds to keep ID/measurement lookups; 0 disables
     ):
         # If any core setting missing, try secret
         if not (url and org and bucket and token):
@@ -110,12 +154,39 @@ class DataCollector:
 
         self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org, timeout=timeout_ms)
         self.query_api = self.client.query_api()
+        # independent queries are bound by server latency, so they are sent concurrently
+        self._pool = ThreadPoolExecutor(max_workers=8)
+        # tags change rarely, so the ID/measurement lookups dashboards repeat can be kept for a while
+        self._measurements_cache = TTLCache(maxsize=512, ttl=cache_ttl) if cache_ttl else None
+        self._experimentIds_cache = TTLCache(maxsize=512, ttl=cache_ttl) if cache_ttl else None
+        self._cache_lock = Lock()
+
+        # Flux templates that only depend on the bucket are built once here;
+        # braces in the bucket name are doubled where the template is later filled in with str.format
+        bucket_literal = _flux_string(self.bucket)
+        bucket_template_literal = bucket_literal.replace("{", "{{").replace("}", "}}")
+        self._flux_base_template = f'from(bucket: {bucket_template_literal})\n  |> range(start: {{start}})\n'
+        self._tag_values_queries = {
+            tag: f'''
+import "influxdata/influxdb/schema"
+schema.tagValues(bucket: {bucket_literal}, tag: "{tag}")
+'''
+            for tag in ("ExperimentId", "ExecutionId")
+        }
+        self._tag_values_for_measurement_templates = {
+            tag: f'''
+import "influxdata/influxdb/schema"
+schema.tagValues(
+  bucket: {bucket_template_literal},
+  tag: "{tag}",
+  predicate: (r) => r._measurement == {{measurement}}
+)
+'''
+            for tag in ("ExperimentId", "ExecutionId")
+        }
 
-        # Best-effort snapshot (public API computes live):
-        try:
-            self.experimentIds = self.get_all_experimentIds()
-        except Exception:
-            self.experimentIds = []
+        # Kept for back-compat only; not populated at startup, use get_all_experimentIds() (computed live)
+        self.experimentIds = []
 
     # ---------------------------- public API ----------------------------
 
@@ -137,46 +208,58 @@ class DataCollector:
         - If no measurements passed, discover them for this experimentId.
         - If fields passed, filter to those _field names.
         - Align to 'max_lag' using aggregateWindow(mean), then pivot.
+        - All measurements are fetched in a single query; tag sets stay separate
+          rows and each measurement's fields are joined on _time.
         Returns a DataFrame indexed by time; columns are fields.
         """
         if not measurements:
             measurements = self.get_measurements_for_experimentId(experimentId, start=start)
 
-        dfs = []
-        for m in measurements:
-            flux = self._flux_base(start=start)
-            flux += f'  |> filter(fn: (r) => r._measurement == "{m}")\n'
-            flux += f'  |> filter(fn: (r) => r.ExperimentId == "{experimentId}" or r.ExecutionId == "{experimentId}")\n'
-
-            if fields:
-                fields_list = ", ".join([f'"{f}"' for f in fields])
-                flux += f"  |> filter(fn: (r) => contains(value: r._field, set: [{fields_list}]))\n"
-
-            # bucket to max_lag and pivot to wide format
-            flux += f'  |> aggregateWindow(every: duration(v: "{max_lag}"), fn: mean, createEmpty: false)\n'
-            flux += '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
-
-            if limit is not None:
-                flux += f"  |> limit(n: {int(limit)}"
-                if offset is not None:
-                    flux += f", offset: {int(offset)}"
-                flux += ")\n"
-
-            df = self._query_df(flux)
-            if not df.empty:
-                # set time index, drop helper cols
-                if "_time" in df.columns:
-                    df = df.set_index(pd.to_datetime(df["_time"]))
-                for c in ("_time", "_start", "_stop", "result", "table"):
-                    if c in df.columns:
-                        df = df.drop(columns=[c])
-                dfs.append(df)
-
-        if not dfs:
+        if not measurements:
             return pd.DataFrame()
 
-        out = pd.concat(dfs, axis=1).sort_index()
-        return out
+        # one query for all measurements instead of one round-trip per measurement
+        measurements_list = ", ".join([_flux_string(m) for m in measurements])
+        flux = self._flux_base(start=start)
+        flux += f"  |> filter(fn: (r) => contains(value: r._measurement, set: [{measurements_list}]))\n"
+        experimentId_literal = _flux_string(experimentId)
+        flux += f'  |> filter(fn: (r) => r.ExperimentId == {experimentId_literal} or r.ExecutionId == {experimentId_literal})\n'
+
+        if fields:
+            fields_list = ", ".join([_flux_string(f) for f in fields])
+            flux += f"  |> filter(fn: (r) => contains(value: r._field, set: [{fields_list}]))\n"
+
+        # bucket to max_lag and pivot each series (measurement + tag set) to wide format
+        flux += f'  |> aggregateWindow(every: duration(v: {_flux_string(max_lag)}), fn: mean, createEmpty: false)\n'
+        flux += '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+
+        if limit is not None:
+            flux += '  |> sort(columns: ["_time"])\n'
+            flux += f"  |> limit(n: {int(limit)}"
+            if offset is not None:
+                flux += f", offset: {int(offset)}"
+            flux += ")\n"
+
+        df = self._query_df(flux)
+        if df.empty:
+            return pd.DataFrame()
+
+        if "_measurement" in df.columns and df["_measurement"].nunique() > 1:
+            # one frame per measurement (only its own columns), joined on time
+            parts = {m: self._time_indexed(part.dropna(axis=1, how="all")) for m, part in df.groupby("_measurement", sort=False)}
+            # fields shared by several measurements are named "<measurement>_<field>", as columnKey: ["_measurement", "_field"] would
+            field_names = pd.Series([c for part in parts.values() for c in part.select_dtypes("number").columns], dtype=object)
+            shared = set(field_names[field_names.duplicated()])
+            if shared:
+                parts = {m: part.rename(columns={c: f"{m}_{c}" for c in part.select_dtypes("number").columns if c in shared}) for m, part in parts.items()}
+            df = pd.concat(parts.values(), axis=1, copy=False)
+        else:
+            df = self._time_indexed(df)
+
+        # pivot output is normally in time order already; only sort if it is not
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        return df
 
     def get_experimentIds_for_measurement(self, measurement: str, start: str = "-90d") -> list[str]:
         """
@@ -184,25 +267,20 @@ class DataCollector:
         Uses schema.tagValues() so values are always in the _value column.
         """
         ids: set[str] = set()
-        for tag in ("ExperimentId", "ExecutionId"):
-            flux = f'''
-import "influxdata/influxdb/schema"
-schema.tagValues(
-  bucket: "{self.bucket}",
-  tag: "{tag}",
-  predicate: (r) => r._measurement == "{measurement}"
-)
-'''
-            df = self._query_df(flux)
+        fluxes = [template.format(measurement=_flux_string(measurement)) for template in self._tag_values_for_measurement_templates.values()]
+        for df in self._query_dfs(fluxes):
             if not df.empty and "_value" in df.columns:
                 ids |= set(df["_value"].dropna().astype(str))
         return sorted(ids)
 
+    @_cached_lookup("_measurements_cache")
     def get_measurements_for_experimentId(self, experimentId: str, start: str = "-90d") -> list[str]:
         """
         List measurements that contain rows for the given experimentId.
+        Non-empty results are cached for cache_ttl seconds, if enabled (see clear_cache()).
         """
-        flux = self._flux_base(start=start) + f'''  |> filter(fn: (r) => r.ExperimentId == "{experimentId}" or r.ExecutionId == "{experimentId}")
+        experimentId_literal = _flux_string(experimentId)
+        flux = self._flux_base(start=start) + f'''  |> filter(fn: (r) => r.ExperimentId == {experimentId_literal} or r.ExecutionId == {experimentId_literal})
   |> keep(columns: ["_measurement"])
   |> group()
   |> distinct(column: "_measurement")
@@ -213,37 +291,64 @@ schema.tagValues(
         col = "_measurement" if "_measurement" in df.columns else "_value"
         return sorted(df[col].dropna().astype(str).unique().tolist())
 
+    @_cached_lookup("_experimentIds_cache")
     def get_all_experimentIds(self, start: str = "-90d") -> list[str]:
         """
-        Union of distinct IDs across the entire bucket (computed live).
+        Union of distinct IDs across the entire bucket (computed live; non-empty results
+        are cached for cache_ttl seconds, if enabled).
         Uses schema.tagValues() so results are read from _value.
         """
         ids: set[str] = set()
-        for tag in ("ExperimentId", "ExecutionId"):
-            flux = f'''
-import "influxdata/influxdb/schema"
-schema.tagValues(bucket: "{self.bucket}", tag: "{tag}")
-'''
-            df = self._query_df(flux)
+        for df in self._query_dfs(self._tag_values_queries.values()):
             if not df.empty and "_value" in df.columns:
                 ids |= set(df["_value"].dropna().astype(str))
         return sorted(ids)
 
+    def clear_cache(self) -> None:
+        """
+        Drop the cached measurement and experiment ID lookups.
+        """
+        with self._cache_lock:
+            for cache in (self._measurements_cache, self._experimentIds_cache):
+                if cache is not None:
+                    cache.clear()
+
     # ---------------------------- internals ----------------------------
 
     def _flux_base(self, start: str) -> str:
-        return f'from(bucket: "{self.bucket}")\n  |> range(start: {start})\n'
+        return self._flux_base_template.format(start=start)
+
+    def _time_indexed(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop the Flux helper columns in one go and index the rows by _time.
+        """
+        df = df.drop(columns=["_start", "_stop", "result", "table"], errors="ignore")
+        if "_time" in df.columns:
+            # the v2 client already parses _time as datetime64[ns, UTC]
+            if not pd.api.types.is_datetime64_any_dtype(df["_time"]):
+                df["_time"] = pd.to_datetime(df["_time"], utc=True)
+            df = df.set_index("_time")
+        return df
 
     def _query_df(self, flux: str) -> pd.DataFrame:
         """
         Run Flux and return a single pandas DataFrame.
-        query_data_frame may return a DataFrame or a list of DataFrames.
+        Tables are consumed from the result stream as they are parsed;
+        a single table is returned as is, without a concat copy.
+        """
+        stream = self.query_api.query_data_frame_stream(flux, org=self.org)
+        tables = [t for t in stream if not t.empty]
+        if not tables:
+            return pd.DataFrame()
+        if len(tables) == 1:
+            return tables[0]
+        return pd.concat(tables, ignore_index=True, copy=False)
+
+    def _query_dfs(self, fluxes: Iterable[str]) -> list[pd.DataFrame]:
+        """
+        Run independent Flux queries concurrently; results are in query order.
         """
-        tables = self.query_api.query_data_frame(flux, org=self.org)
-        if isinstance(tables, list):
-            tables = [t for t in tables if isinstance(t, pd.DataFrame) and not t.empty]
-            return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
-        return tables if isinstance(tables, pd.DataFrame) else pd.DataFrame()
+        return list(self._pool.map(self._query_df, fluxes))
 
     # Old v1 name (explicitly unsupported on v2)
     def query_df(self, query: str) -> pd.DataFrame:
@@ -1,40 +1,35 @@
 from influxdb import InfluxDBClient
 from random import randint
-from time import sleep
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # InfluxDB connection settings
 client = InfluxDBClient(host='localhost', port=8086, username='isakl', password='qwertyui', database='testDB')
 
-# Generate and upload random data
-for _ in range(10):
-    timestamp = datetime.utcnow().isoformat()
+# Generate random data points, one second apart and ending now
+number_of_points = 10
+end = datetime.utcnow()
+location = "us-midwest"
+points = []
+for i in range(number_of_points):
+    timestamp = (end - timedelta(seconds=number_of_points - 1 - i)).isoformat()
     temperature = randint(0, 100)
-    location = "us-midwest"
 
     # Create the data point
-    json_body = [
-        {
-            "measurement": "weather",
-            "tags": {
-                "location": location
-            },
-            "time": timestamp,
-            "fields": {
-                "temperature": temperature
-            }
+    points.append({
+        "measurement": "weather",
+        "tags": {
+            "location": location
+        },
+        "time": timestamp,
+        "fields": {
+            "temperature": temperature
         }
-    ]
-
-	
-
-    # Write the data point to InfluxDB
-    client.write_points(json_body)
+    })
 
     # Print a confirmation message
-    print(f"Data point {temperature} added at {timestamp}")
+    print(f"Data point {temperature} generated at {timestamp}")
 
-    # Sleep for a second before generating the next data point
-    sleep(1)
+# Write all data points to InfluxDB in one batched request
+client.write_points(points, batch_size=500)
 
 print("Data upload complete.")